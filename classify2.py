@@ -1,22 +1,32 @@
-import json
+import orjson
 import joblib
 import os
+import functools
+import csv
+import sys
 import numpy as np
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer
+from sklearn.pipeline import Pipeline
+from sklearn.svm import SVC
 
-def classify():
+@functools.lru_cache(maxsize=4)
+def _load(path, mtime):
+    # mtime is part of the cache key so a retrained pickle is picked up
+    return joblib.load(path)
+
+def classify(json_file="output.json"):
     model_path = "svm_model.pkl"
     vectorizer_path = "tfidf_vectorizer.pkl"
-    json_file = "output.json"
 
     if not os.path.exists(model_path) or not os.path.exists(vectorizer_path):
         raise FileNotFoundError("SVM model or TF-IDF vectorizer not found!")
 
     print("🔄 Loading model and vectorizer...")
-    svm_model = joblib.load(model_path)
-    tfidf_vectorizer = joblib.load(vectorizer_path)
+    svm_model = _load(model_path, os.path.getmtime(model_path))
+    tfidf_vectorizer = _load(vectorizer_path, os.path.getmtime(vectorizer_path))
 
-    with open(json_file, "r") as f:
-        data = json.load(f)
+    with open(json_file, "rb") as f:
+        data = orjson.loads(f.read())
 
     if isinstance(data, dict) and "transcription" in data:
         speech_segments = [seg for seg in data["transcription"] if seg["type"] == "speech"]
@@ -37,13 +47,39 @@ def classify():
         for segment, label in zip(speech_segments, predictions):
             segment["classification"] = "Relevant" if label == 1 else "Irrelevant"
 
-        with open(json_file, "w") as f:
-            json.dump(data, f, indent=4)
+        with open(json_file, "wb") as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
 
         print(f"✅ Classification completed and saved in {json_file}")
     else:
         print("⚠️ No speech segments found for classification.")
 
+def train(texts, labels, model_path="svm_model.pkl", vectorizer_path="tfidf_vectorizer.pkl"):
+    """Fit a hashed TF-IDF pipeline and linear SVM on labelled text (1 = Relevant) and save both."""
+    # Hashing needs no vocabulary lookups at transform time; IDF and l2 norm are applied afterwards
+    tfidf_vectorizer = Pipeline([
+        ("hash", HashingVectorizer(n_features=2**18, alternate_sign=False, norm=None)),
+        ("tfidf", TfidfTransformer()),
+    ])
+    text_features = tfidf_vectorizer.fit_transform(texts)
+
+    # Same hyperparameters as the shipped svm_model.pkl
+    svm_model = SVC(kernel="linear", probability=True)
+    svm_model.fit(text_features, labels)
+
+    joblib.dump(svm_model, model_path)
+    joblib.dump(tfidf_vectorizer, vectorizer_path)
+    print(f"✅ Model saved to {model_path} and vectorizer saved to {vectorizer_path}")
+
+def train_from_csv(csv_path):
+    """Train from a CSV with "text" and "label" columns (1 = Relevant, 0 = Irrelevant)."""
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    train([row["text"] for row in rows], [int(row["label"]) for row in rows])
+
 # Ensure it only runs when explicitly called
 if __name__ == "__main__":
-    classify()
+    if len(sys.argv) == 3 and sys.argv[1] == "train":
+        train_from_csv(sys.argv[2])
+    else:
+        classify()
@@ -1,81 +1,303 @@
 import ffmpeg
-import whisper
-import json
+import ctranslate2
+from faster_whisper import WhisperModel
+import functools
+import orjson
 import subprocess
-import re
 import os
+import tempfile
+import bisect
+import hashlib
+import inspect
+import heapq
+from multiprocessing.pool import ThreadPool
 import classify2
-import librosa
+import numpy as np
 import soundfile as sf
 import srt
 from scipy import signal
 
-def vid_to_aud(input_video_path, output_audio_path="temp_audio.mp3"):
-    """Extract audio from video using ffmpeg."""
-    subprocess.run([
-        "ffmpeg", "-i", input_video_path, "-q:a", "0", "-map", "a", output_audio_path, "-y"
+SAMPLE_RATE = 16000
+
+CACHE_DIR = os.environ.get("VIDEO_EDITOR_CACHE", "cache")
+
+TRANSCRIBE_OPTIONS = {"word_timestamps": True, "vad_filter": True}
+
+HARDWARE_ENCODER_ARGS = [
+    ["-c:v", "h264_nvenc", "-preset", "p4", "-rc", "vbr", "-cq", "23"],
+    ["-c:v", "h264_videotoolbox"],
+]
+
+SOFTWARE_ENCODER_ARGS = ["-c:v", "libx264"]
+
+SPEECH_BANDPASS = "highpass=f=300,lowpass=f=3400"
+
+@functools.lru_cache(maxsize=1)
+def _video_encoder_args():
+    """Pick the first hardware H.264 encoder that can encode a test frame, else libx264."""
+    # Builds list encoders (and cuda under -hwaccels) even with no device behind them,
+    # so only a real one-frame encode tells us the encoder works on this machine
+    for encoder_args in HARDWARE_ENCODER_ARGS:
+        probe = subprocess.run([
+            "ffmpeg", "-hide_banner", "-loglevel", "error", "-f", "lavfi", "-i", "nullsrc",
+            "-frames:v", "1", *encoder_args, "-f", "null", "-"
+        ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if probe.returncode == 0:
+            return encoder_args
+    return SOFTWARE_ENCODER_ARGS
+
+def run_encode(args, output_path, check=False):
+    """Run an ffmpeg encode with hardware decoding and the encoder picked by _video_encoder_args."""
+    command = ["ffmpeg", "-hwaccel", "auto", *args, *_video_encoder_args(), output_path, "-y"]
+    return subprocess.run(command, check=check)
+
+def _fingerprint(path, chunk_size=1 << 20):
+    """Hash a file's size plus its first and last megabyte as a cheap content key."""
+    size = os.path.getsize(path)
+    h = hashlib.sha256(str(size).encode())
+    with open(path, "rb") as f:
+        h.update(f.read(chunk_size))
+        if size > chunk_size:
+            f.seek(max(size - chunk_size, chunk_size))
+            h.update(f.read(chunk_size))
+    return h.hexdigest()
+
+def _cache_key(*parts):
+    """Hash everything that affects a cached result into one key."""
+    return hashlib.sha256(orjson.dumps(parts, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+def _cache_path(key, kind):
+    return os.path.join(CACHE_DIR, f"{key}.{kind}.json")
+
+def _load_cache(cache_path):
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        with open(cache_path, "rb") as f:
+            return orjson.loads(f.read())
+    except orjson.JSONDecodeError:
+        # A corrupt entry is treated as a miss and overwritten on the next save
+        return None
+
+def _save_cache(cache_path, data):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    # Write to a temp file and swap it in, so an interrupted run never leaves a partial entry
+    fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(orjson.dumps(data))
+        os.replace(tmp_path, cache_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+def vid_to_aud(input_video_path, sr=SAMPLE_RATE):
+    """Decode the video's audio to mono float32 PCM in memory using ffmpeg."""
+    buf = subprocess.check_output([
+        "ffmpeg", "-nostdin", "-i", input_video_path, "-vn",
+        "-f", "s16le", "-ac", "1", "-ar", str(sr), "pipe:1"
     ])
-    return output_audio_path
+    return np.frombuffer(buf, np.int16).astype(np.float32) / 32768.0
+
+@functools.lru_cache(maxsize=2)
+def _get_whisper(name):
+    """Load a faster-whisper model once and keep it resident for later calls."""
+    if ctranslate2.get_cuda_device_count() > 0:
+        return WhisperModel(name, device="cuda", compute_type="int8_float16")
+    return WhisperModel(name, device="cpu", compute_type="int8")
+
+def transcribe(audio, model_name="small"):
+    """Transcribe an audio file or 16 kHz PCM array and return its segments as plain dicts."""
+    whisper_model = _get_whisper(model_name)
+    segments, _ = whisper_model.transcribe(audio, **TRANSCRIBE_OPTIONS)
+    # faster-whisper rounds timestamps to numpy.float64, which orjson cannot serialize
+    return [
+        {"start": float(segment.start), "end": float(segment.end), "text": segment.text}
+        for segment in segments
+    ]
 
-def process_video(input_vid_path):
-    """Transcribe video and return speech data with timestamps."""
-    audio_path = vid_to_aud(input_vid_path)
-    whisper_model = whisper.load_model("small")
-    transcription_result = whisper_model.transcribe(audio_path, word_timestamps=True)
+def transcript_cache_path(input_vid_path, model_name="small"):
+    key = _cache_key(_fingerprint(input_vid_path), model_name, TRANSCRIBE_OPTIONS)
+    return _cache_path(key, "transcript")
+
+def process_video(input_vid_path, audio=None, model_name="small"):
+    """Transcribe video and return speech data with timestamps, reusing a cached transcript if present."""
+    cache_path = transcript_cache_path(input_vid_path, model_name)
+    speech_data = _load_cache(cache_path)
+    if speech_data is not None:
+        print(f"♻️ Using cached transcript from {cache_path}")
+        return speech_data
+    
+    if audio is None:
+        audio = vid_to_aud(input_vid_path)
+    segments = transcribe(audio, model_name)
     
     speech_data = [
         {"start": segment["start"], "end": segment["end"], "type": "speech", "text": segment["text"]}
-        for segment in transcription_result["segments"]
+        for segment in segments
     ]
+    _save_cache(cache_path, speech_data)
     return speech_data
 
-def detect_silence(audio_path):
-    """Detect silence in audio using ffmpeg."""
-    command = [
-        "ffmpeg", "-i", audio_path, "-af",
-        "silencedetect=noise=-30dB:d=0.5", "-f", "null", "-"
+def detect_silence_np(x, sr=SAMPLE_RATE, hop_seconds=0.02, min_dur=0.5, thresh_db=-30):
+    """Detect silence in PCM audio by thresholding the mean power of short windows."""
+    if len(x) == 0:
+        return []
+    hop = max(1, int(hop_seconds * sr))
+    window_starts = np.arange(0, len(x), hop)
+    window_lengths = np.diff(np.append(window_starts, len(x)))
+    power = np.add.reduceat(x * x, window_starts) / window_lengths
+    silent = power < 10 ** (thresh_db / 10)
+    
+    # Run-length encode the silent windows and keep runs of at least min_dur
+    edges = np.diff(np.concatenate(([0], silent.astype(np.int8), [0])))
+    # The last window may be partial, so measure runs in samples rather than whole hops
+    run_starts = np.flatnonzero(edges == 1) * hop
+    run_ends = np.minimum(np.flatnonzero(edges == -1) * hop, len(x))
+    long_enough = run_ends - run_starts >= min_dur * sr
+    
+    return [
+        {"start": start / sr, "end": end / sr, "type": "silence"}
+        for start, end in zip(run_starts[long_enough].tolist(), run_ends[long_enough].tolist())
     ]
-    result = subprocess.run(command, stderr=subprocess.PIPE, text=True)
-    return result.stderr
 
-def parse_silence_data(ffmpeg_output):
-    """Parse silence data from ffmpeg output."""
-    silence_data = []
-    silence_start_times = re.findall(r"silence_start: (\d+\.\d+)", ffmpeg_output)
-    silence_end_times = re.findall(r"silence_end: (\d+\.\d+)", ffmpeg_output)
+def silence_cache_path(input_vid_path, **params):
+    # Key on the effective settings, so changing a detect_silence_np default invalidates the cache
+    effective = {
+        name: p.default
+        for name, p in inspect.signature(detect_silence_np).parameters.items()
+        if p.default is not inspect.Parameter.empty
+    }
+    effective.update(params)
+    return _cache_path(_cache_key(_fingerprint(input_vid_path), effective), "silence")
+
+def detect_video_silence(input_vid_path, audio=None, **params):
+    """Detect silence in a video's audio, reusing a cached result if present."""
+    cache_path = silence_cache_path(input_vid_path, **params)
+    silence_data = _load_cache(cache_path)
+    if silence_data is not None:
+        print(f"♻️ Using cached silence data from {cache_path}")
+        return silence_data
     
-    for start, end in zip(silence_start_times, silence_end_times):
-        silence_data.append({"start": float(start), "end": float(end), "type": "silence"})
+    if audio is None:
+        audio = vid_to_aud(input_vid_path)
+    silence_data = detect_silence_np(audio, **params)
+    _save_cache(cache_path, silence_data)
     return silence_data
 
 def merge_and_save_json(speech_data, silence_data, output_json="output.json"):
     """Merge speech and silence data, save to JSON."""
-    all_data = sorted(speech_data + silence_data, key=lambda x: x["start"])
-    with open(output_json, "w") as f:
-        json.dump(all_data, f, indent=4)
+    # Both inputs are already ordered by start time, so a linear merge is enough
+    all_data = list(heapq.merge(speech_data, silence_data, key=lambda x: x["start"]))
+    with open(output_json, "wb") as f:
+        f.write(orjson.dumps(all_data, option=orjson.OPT_INDENT_2))
     print(f"✅ Merged data saved to {output_json}")
 
-def classify_speech():
-    """Classify speech segments as relevant/irrelevant."""
-    classify2.classify()
+def classify_speech(json_file="output.json"):
+    """Classify speech segments as relevant/irrelevant, reusing a cached result if present."""
+    # Key on the merged segments and the classifier files, so retraining invalidates the cache
+    with open(json_file, "rb") as f:
+        segments_hash = hashlib.sha256(f.read()).hexdigest()
+    model_mtimes = [os.path.getmtime(model_file) for model_file in ("svm_model.pkl", "tfidf_vectorizer.pkl")]
+    cache_path = _cache_path(_cache_key(segments_hash, model_mtimes), "classified")
+    
+    data = _load_cache(cache_path)
+    if data is not None:
+        with open(json_file, "wb") as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+        print(f"♻️ Using cached classification from {cache_path}")
+        return
+    
+    classify2.classify(json_file)
+    with open(json_file, "rb") as f:
+        _save_cache(cache_path, orjson.loads(f.read()))
     print("✅ Speech data classified successfully in the JSON file")
 
-def trim_segments(input_vid_path, output_vid_path="output_trimmed.mp4"):
-    """Trim silent and irrelevant parts from the video."""
-    with open("output.json", "r") as f:
-        data = json.load(f)
-    
-    # Keep only relevant segments
-    keep_segments = [
+def merge_ranges(segments, max_gap=0.05):
+    """Coalesce (start, end) ranges separated by less than max_gap seconds."""
+    merged = []
+    for start, end in segments:
+        if merged and start - merged[-1][1] < max_gap:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+def keyframe_times(input_vid_path):
+    """List the presentation times of the video's keyframes from packet flags, without decoding."""
+    result = subprocess.run([
+        "ffprobe", "-v", "error", "-select_streams", "v:0",
+        "-show_entries", "packet=pts_time,flags", "-of", "csv=p=0", input_vid_path
+    ], stdout=subprocess.PIPE, text=True)
+    keyframes = []
+    for line in result.stdout.split():
+        pts_time, _, flags = line.partition(",")
+        if "K" in flags and pts_time != "N/A":
+            keyframes.append(float(pts_time))
+    return sorted(keyframes)
+
+def snap_to_keyframes(segments, keyframes, tolerance=0.04):
+    """Move each range start back to its keyframe, or return None if any range is too far from one."""
+    if not keyframes:
+        return None
+    snapped = []
+    for start, end in segments:
+        # An input -ss with -c copy snaps back to the keyframe at or before start, so only
+        # that keyframe counts; a later one would leave a whole GOP of extra footage
+        idx = bisect.bisect_right(keyframes, start) - 1
+        if idx < 0 or start - keyframes[idx] > tolerance:
+            return None
+        snapped.append((keyframes[idx], end))
+    return snapped
+
+def plan_cuts(data, input_vid_path=None):
+    """Return the ranges to keep and whether they can be cut from input_vid_path with stream copy."""
+    # Keep only relevant segments, merging near-adjacent ones into a single cut
+    keep_segments = merge_ranges([
         (entry["start"], entry["end"])
         for entry in data
         if entry.get("classification") == "Relevant"
-    ]
-    
-    if not keep_segments:
-        print("⚠️ No relevant segments found. Exiting...")
-        return
-    
+    ])
+    # Stream copy is only frame-accurate when every cut starts on a keyframe; the snapped
+    # starts are returned so captions use the same cut points ffmpeg will
+    if input_vid_path and keep_segments:
+        snapped = snap_to_keyframes(keep_segments, keyframe_times(input_vid_path))
+        if snapped is not None:
+            return snapped, True
+    return keep_segments, False
+
+def _cut_range(input_vid_path, start, end, output_path):
+    """Copy one range of the video into its own file without re-encoding."""
+    subprocess.run([
+        "ffmpeg", "-nostdin", "-ss", str(start), "-to", str(end), "-i", input_vid_path,
+        "-c", "copy", "-avoid_negative_ts", "make_zero", output_path, "-y"
+    ], check=True)
+
+def _trim_with_stream_copy(input_vid_path, keep_segments, output_vid_path, srt_path, denoise):
+    """Cut ranges with stream copy and join them with the concat demuxer."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        parts = [os.path.join(tmp_dir, f"part_{idx}.ts") for idx in range(len(keep_segments))]
+        # Each cut is its own ffmpeg process, so threads are enough to keep every core busy
+        with ThreadPool() as pool:
+            pool.starmap(_cut_range, [
+                (input_vid_path, start, end, part)
+                for (start, end), part in zip(keep_segments, parts)
+            ])
+        
+        list_path = os.path.join(tmp_dir, "list.txt")
+        with open(list_path, "w") as f:
+            f.writelines(f"file '{part.replace(os.sep, '/')}'\n" for part in parts)
+        
+        args = ["-f", "concat", "-safe", "0", "-i", list_path]
+        args += ["-af", SPEECH_BANDPASS] if denoise else ["-c:a", "copy"]
+        if srt_path:
+            # Burning in captions still needs one encode, but only of the kept footage
+            run_encode(args + ["-vf", f"subtitles={srt_path}"], output_vid_path)
+        else:
+            subprocess.run(["ffmpeg", *args, "-c:v", "copy", output_vid_path, "-y"])
+
+def _trim_with_filter_graph(input_vid_path, keep_segments, output_vid_path, srt_path, denoise):
+    """Cut and join ranges in a single ffmpeg filter graph."""
     # Generate FFmpeg filter for trimming
     filter_complex = "".join([
         f"[0:v]trim=start={start}:end={end},setpts=PTS-STARTPTS[v{idx}]; "
@@ -85,20 +307,46 @@ def trim_segments(input_vid_path, output_vid_path="output_trimmed.mp4"):
     
     concat_v = "".join([f"[v{idx}][a{idx}]" for idx in range(len(keep_segments))]) + f"concat=n={len(keep_segments)}:v=1:a=1 [v][a]"
     
-    command = [
-        "ffmpeg", "-i", input_vid_path, "-filter_complex",
+    # Chain captions and the speech bandpass onto the same graph so the video is encoded once
+    video_out, audio_out = "[v]", "[a]"
+    if srt_path:
+        concat_v += f"; [v]subtitles={srt_path}[vout]"
+        video_out = "[vout]"
+    if denoise:
+        concat_v += f"; [a]{SPEECH_BANDPASS}[aout]"
+        audio_out = "[aout]"
+    
+    args = [
+        "-i", input_vid_path, "-filter_complex",
         filter_complex + concat_v,
-        "-map", "[v]", "-map", "[a]",
-        output_vid_path, "-y"
+        "-map", video_out, "-map", audio_out
     ]
     
-    subprocess.run(command)
+    run_encode(args, output_vid_path)
+
+def trim_segments(input_vid_path, output_vid_path="output_trimmed.mp4", srt_path=None, denoise=False):
+    """Trim silent and irrelevant parts from the video, optionally denoising and burning in captions."""
+    with open("output.json", "rb") as f:
+        data = orjson.loads(f.read())
+    
+    keep_segments, stream_copy = plan_cuts(data, input_vid_path)
+    
+    if not keep_segments:
+        print("⚠️ No relevant segments found. Exiting...")
+        return
+    
+    if stream_copy:
+        _trim_with_stream_copy(input_vid_path, keep_segments, output_vid_path, srt_path, denoise)
+    else:
+        _trim_with_filter_graph(input_vid_path, keep_segments, output_vid_path, srt_path, denoise)
     print(f"✅ Trimmed video saved as {output_vid_path}")
     return output_vid_path
 
 def apply_noise_reduction(audio_path, output_audio="denoised_audio.wav"):
     """Apply noise reduction to audio."""
-    y, sr = librosa.load(audio_path, sr=None)
+    y, sr = sf.read(audio_path, dtype='float32')
+    if y.ndim == 2:
+        y = y.mean(axis=1)
     filtered_audio = bandpass_filter(y, 300, 3400, sr)
     sf.write(output_audio, filtered_audio, sr)
     return output_audio
@@ -107,41 +355,52 @@ def bandpass_filter(audio_data, lowcut, highcut, sr, order=6):
     """Apply a bandpass filter to audio data."""
     nyquist = 0.5 * sr
     low, high = lowcut / nyquist, highcut / nyquist
-    b, a = signal.butter(order, [low, high], btype='band')
-    return signal.lfilter(b, a, audio_data)
-
-def generate_captions_from_trimmed_video(trimmed_video_path, srt_file="captions.srt"):
-    """Generate captions from the trimmed video's audio."""
-    # Extract audio from the trimmed video
-    trimmed_audio_path = vid_to_aud(trimmed_video_path, "trimmed_audio_for_captions.mp3")
-    
-    # Transcribe the trimmed audio
-    whisper_model = whisper.load_model("small")
-    transcription_result = whisper_model.transcribe(trimmed_audio_path, word_timestamps=True)
-    
-    # Generate subtitles
-    subtitles = [
-        srt.Subtitle(
-            index=i + 1,
-            start=srt.timedelta(seconds=seg['start']),
-            end=srt.timedelta(seconds=seg['end']),
+    sos = signal.butter(order, [low, high], btype='band', output='sos')
+    y = np.asarray(audio_data).astype(np.float32, copy=False)
+    return signal.sosfilt(sos.astype(np.float32), y)
+
+def generate_captions(json_file="output.json", srt_file="captions.srt", input_vid_path=None):
+    """Generate captions for the trimmed video from the first-pass transcript.
+    
+    Pass the same input_vid_path as trim_segments so captions follow its keyframe-snapped cuts.
+    """
+    with open(json_file, "rb") as f:
+        data = orjson.loads(f.read())
+    
+    relevant = [seg for seg in data if seg.get("classification") == "Relevant"]
+    keep_ranges, _ = plan_cuts(data, input_vid_path)
+    
+    # Each kept range is shifted back by the duration removed before it,
+    # matching the cuts trim_segments makes
+    offsets = []
+    elapsed = 0.0
+    for start, end in keep_ranges:
+        offsets.append(start - elapsed)
+        elapsed += end - start
+    
+    subtitles = []
+    range_idx = 0
+    for seg in relevant:
+        while seg["start"] > keep_ranges[range_idx][1]:
+            range_idx += 1
+        offset = offsets[range_idx]
+        subtitles.append(srt.Subtitle(
+            index=len(subtitles) + 1,
+            start=srt.timedelta(seconds=seg['start'] - offset),
+            end=srt.timedelta(seconds=seg['end'] - offset),
             content=seg['text']
-        )
-        for i, seg in enumerate(transcription_result["segments"])
-    ]
+        ))
     
     # Save subtitles to SRT file
     with open(srt_file, "w") as f:
         f.write(srt.compose(subtitles))
     
-    print(f"✅ Captions generated from trimmed video and saved as: {srt_file}")
+    print(f"✅ Captions generated for trimmed video and saved as: {srt_file}")
     return srt_file
 
 def overlay_captions(video_path, srt_path, output_video="final_video_with_captions.mp4"):
     """Overlay captions on the video."""
-    subprocess.run([
-        "ffmpeg", "-i", video_path, "-vf", f"subtitles={srt_path}", output_video
-    ], check=True)
+    run_encode(["-i", video_path, "-vf", f"subtitles={srt_path}"], output_video, check=True)
     print(f"✅ Captions overlaid successfully, saved as: {output_video}")
     return output_video
 
@@ -159,12 +418,19 @@ def replace_audio(video_path, new_audio, output_video="final_output.mp4"):
 if __name__ == "__main__":
     input_vid_path = r"D:\Smartcut_using_SVM\test_video_files\asympt_tuto.mp4"
     
-    print("🔄 Processing video...")
-    speech_data = process_video(input_vid_path)
+    # Decode the audio once, and only if the silence or transcript cache misses
+    audio = None
+    cache_paths = (silence_cache_path(input_vid_path), transcript_cache_path(input_vid_path))
+    if not all(os.path.exists(path) for path in cache_paths):
+        print("🎤 Extracting audio...")
+        audio = vid_to_aud(input_vid_path)
     
     print("🔎 Detecting silence...")
-    ffmpeg_output = detect_silence("temp_audio.mp3")
-    silence_data = parse_silence_data(ffmpeg_output)
+    silence_data = detect_video_silence(input_vid_path, audio)
+    
+    print("🔄 Processing video...")
+    speech_data = process_video(input_vid_path, audio)
+    del audio
     
     print("📂 Saving merged data...")
     merge_and_save_json(speech_data, silence_data)
@@ -172,22 +438,10 @@ if __name__ == "__main__":
     print("🧠 Running classification...")
     classify_speech()
     
-    print("✂️ Trimming silence and irrelevant parts...")
-    trimmed_video_path = trim_segments(input_vid_path)
-    
-    print("🎤 Extracting audio from trimmed video...")
-    trimmed_audio_path = vid_to_aud(trimmed_video_path, "trimmed_audio.mp3")
-    
-    print("🔇 Applying noise reduction to audio...")
-    denoised_audio_path = apply_noise_reduction(trimmed_audio_path)
-    
-    print("📝 Generating captions from trimmed video...")
-    srt_file = generate_captions_from_trimmed_video(trimmed_video_path)
-    
-    print("🔊 Replacing audio with denoised version...")
-    final_video_with_audio = replace_audio(trimmed_video_path, denoised_audio_path)
+    print("📝 Generating captions for trimmed video...")
+    srt_file = generate_captions(input_vid_path=input_vid_path)
     
-    print("🎥 Overlaying captions on video...")
-    final_output = overlay_captions(final_video_with_audio, srt_file)
+    print("✂️ Trimming, denoising and captioning in a single pass...")
+    final_output = trim_segments(input_vid_path, "final_video_with_captions.mp4", srt_path=srt_file, denoise=True)
     
     print(f"✅ Final edited video saved as: {final_output}")
\ No newline at end of file